@@ -26,50 +26,99 @@ __version__ = '1.0'
 
 import argparse
 import functools
-import matplotlib.pyplot as plt
+import random
+import re
 import requests
 import sys
+import time
 
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime as dt
+from requests.adapters import HTTPAdapter
 from requests.exceptions import RequestException
+from urllib3.util.retry import Retry
 
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
 
-def clear_error(func):
-    @functools.wraps(func)
-    def wrapper(*args, **kwargs):
-        args[0].last_error = None
-        return func(*args, **kwargs)
 
-    return wrapper
+class JitterRetry(Retry):
+    """Retry with a random jitter added to the exponential backoff and a capped Retry-After."""
+    BACKOFF_JITTER = 0.3
+    RETRY_AFTER_MAX = 5
+
+    def get_backoff_time(self):
+        backoff = super().get_backoff_time()
+        return backoff + random.random() * self.BACKOFF_JITTER if backoff else backoff
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        return min(retry_after, self.RETRY_AFTER_MAX) if retry_after is not None else None
 
 
 class CurrencyConverter:
+    __slots__ = ('last_error', '_session', '_rate_cache', '_currencies_cache')
+
     REQUEST_CURRENCIES = 'https://api.nbrb.by/exrates/currencies'
     REQUEST_RATES = 'https://api.nbrb.by/exrates/rates'
     REQUEST_DYNAMICS = 'https://api.nbrb.by/exrates/rates/dynamics'
 
+    _RATES_PREFIX = REQUEST_RATES + '/'
+    _DYNAMICS_PREFIX = REQUEST_DYNAMICS + '/'
+
     DATE_LONG = '%Y-%m-%dT%H:%M:%S'
     DATE_SHORT = '%Y-%m-%d'
 
+    MAX_WORKERS = 8
+    TIMEOUT = (3.05, 10)
+
+    RATE_TTL = 300
+    RATE_CACHE_SIZE = 512
+    CURRENCIES_TTL = 86400
+
+    _style_applied = False
+    _rate_urls = {}
+
     def __init__(self):
         self.last_error = None
+        self._session = self._make_session()
+        self._rate_cache = OrderedDict()
+        self._currencies_cache = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _make_session(self):
+        """Create HTTP session with keep-alive connections and retries."""
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.MAX_WORKERS,
+                              max_retries=JitterRetry(total=3, connect=2, read=2, backoff_factor=0.2,
+                                                      allowed_methods=['GET'], status_forcelist=(502, 503, 504)))
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def clear_cache(self):
+        """Clear cached rates and currencies."""
+        self._rate_cache.clear()
+        self._currencies_cache = None
+
+    def close(self):
+        """Close HTTP session."""
+        self._session.close()
 
     @staticmethod
-    def _check_val_code(val):
-        """Check the currency code is correct."""
-        if isinstance(val, str):
-            return (len(val) == 3) and val.isalpha()
-        return False
-
-    @staticmethod
-    def _date_to_str(date, to_format):
-        """Convert date to string."""
-        date_string = None
-        try:
-            date_string = date.strftime(to_format)
-        except (TypeError, ValueError):
-            pass
-        return date_string
+    def _normalize(val):
+        """Return the upper-case currency code or None if the code is incorrect."""
+        if type(val) is str and len(val) == 3 and val.isascii() and val.isalpha():
+            return val.upper()
+        return None
 
     @staticmethod
     def _date_from_str(date_string, from_format):
@@ -82,19 +131,54 @@ class CurrencyConverter:
         return date
 
     @staticmethod
-    def _make_request(request, params=None):
+    def _parse_long(date_string):
+        """Convert string in DATE_LONG format to date without strptime."""
+        if not isinstance(date_string, str) or len(date_string) < 19:
+            return None
+        try:
+            return dt(int(date_string[0:4]), int(date_string[5:7]), int(date_string[8:10]),
+                      int(date_string[11:13]), int(date_string[14:16]), int(date_string[17:19]))
+        except ValueError:
+            return None
+
+    def _make_request(self, request, params=None):
         """Make request and return response."""
         response, error = {}, None
         try:
-            r = requests.get(request, params=params, timeout=(2, 5))
+            r = self._session.get(request, params=params, timeout=self.TIMEOUT)
             r.raise_for_status()
-            response = r.json()
-        except RequestException as e:
+            response = json_loads(r.content)
+        except (RequestException, ValueError) as e:
             error = e
         finally:
             return response, error
 
-    @clear_error
+    def _index_currencies(self, response):
+        """Group the currencies with correct periods by the currency code."""
+        index = {}
+        for res in response:
+            date_start = self._parse_long(res.get('Cur_DateStart'))
+            date_end = self._parse_long(res.get('Cur_DateEnd'))
+            if not date_start or not date_end:
+                continue
+            index.setdefault(res.get('Cur_Abbreviation', ''), []).append({
+                'Cur_ID': res.get('Cur_ID'),
+                'Cur_Scale': res.get('Cur_Scale', 1.0),
+                'Cur_DateStart': date_start,
+                'Cur_DateEnd': date_end})
+        return index
+
+    def _get_currencies(self):
+        """Return the currencies grouped by the currency code, cached for CURRENCIES_TTL seconds."""
+        if self._currencies_cache and time.monotonic() - self._currencies_cache[0] < self.CURRENCIES_TTL:
+            return self._currencies_cache[1], None
+        response, error = self._make_request(self.REQUEST_CURRENCIES)
+        if error:
+            return {}, error
+        index = self._index_currencies(response)
+        self._currencies_cache = (time.monotonic(), index)
+        return index, None
+
     def get_rate_dynamics(self, val, start_date, end_date):
         """ This function finds rate of currency in BYN for the period.
             It receives:
@@ -103,11 +187,13 @@ class CurrencyConverter:
                end_date - the end of period in format 'YYYY-MM-DD'
             It returns a tuple with currency scale and dictionary with rates for the period.
         """
-        if not self._check_val_code(val):
+        self.last_error = None
+        val_upper = self._normalize(val)
+        if not val_upper:
             self.last_error = f'The currency code "{val}" is incorrect'
             return 1.0, {}
 
-        if val.upper() == 'BYN':
+        if val_upper == 'BYN':
             self.last_error = ''
             return 1.0, {}
 
@@ -129,47 +215,62 @@ class CurrencyConverter:
             self.last_error = f'The period from {beg_period:%Y-%m-%d} to {end_period:%Y-%m-%d}" is more than 365 days'
             return 1.0, {}
 
-        response, error = self._make_request(self.REQUEST_CURRENCIES)
+        currencies, error = self._get_currencies()
         if error:
             self.last_error = str(error)
             return 1.0, {}
 
-        vals = [{'Cur_ID': res.get('Cur_ID'),
-                 'Cur_Scale': res.get('Cur_Scale', 1.0),
-                 'Cur_DateStart': self._date_from_str(res.get('Cur_DateStart'), self.DATE_LONG),
-                 'Cur_DateEnd': self._date_from_str(res.get('Cur_DateEnd'), self.DATE_LONG)}
-                for res in response if res.get('Cur_Abbreviation', '') == val.upper()]
-        filter_period = (lambda x: (x['Cur_DateStart'] and x['Cur_DateEnd'] and
-                                    (x['Cur_DateStart'] <= beg_period <= x['Cur_DateEnd'] or
-                                     x['Cur_DateStart'] <= end_period <= x['Cur_DateEnd'])))
-        vals = list(filter(filter_period, vals))
+        vals = [v for v in currencies.get(val_upper, ())
+                if v['Cur_DateStart'] <= end_period and beg_period <= v['Cur_DateEnd']]
 
         if len(vals) == 0:
-            self.last_error = f'The currency "{val.upper()}" not found'
+            self.last_error = f'The currency "{val_upper}" not found'
             return 1.0, {}
 
         rates = {}
-        scale = sorted(vals, key=lambda x: (x['Cur_DateStart'], x['Cur_DateEnd']))[-1]['Cur_Scale']
+        scale = max(vals, key=lambda x: (x['Cur_DateStart'], x['Cur_DateEnd']))['Cur_Scale']
 
+        params = []
         for v in vals:
-            val_code = v.get('Cur_ID')
-            params = {'startdate': self._date_to_str(max([beg_period, v.get('Cur_DateStart')]), self.DATE_SHORT),
-                      'enddate': self._date_to_str(min([end_period, v.get('Cur_DateEnd')]), self.DATE_SHORT)}
-            response, error = self._make_request(f'{self.REQUEST_DYNAMICS}/{val_code}', params)
+            date_start, date_end = v['Cur_DateStart'], v['Cur_DateEnd']
+            start = beg_period if beg_period > date_start else date_start
+            end = end_period if end_period < date_end else date_end
+            params.append((self._DYNAMICS_PREFIX + str(v['Cur_ID']),
+                           {'startdate': f'{start.year:04d}-{start.month:02d}-{start.day:02d}',
+                            'enddate': f'{end.year:04d}-{end.month:02d}-{end.day:02d}'}))
+        responses = {}
+        if len(params) > 1:
+            with ThreadPoolExecutor(max_workers=min(self.MAX_WORKERS, len(params))) as executor:
+                futures = {executor.submit(self._make_request, *p): i for i, p in enumerate(params)}
+                for future in as_completed(futures):
+                    response, error = future.result()
+                    if error:
+                        for f in futures:
+                            f.cancel()
+                        self.last_error = str(error)
+                        return 1.0, {}
+                    responses[futures[future]] = response
+        else:
+            response, error = self._make_request(*params[0])
             if error:
                 self.last_error = str(error)
-                return {}
-            rates.update({self._date_from_str(rate.get('Date'), self.DATE_LONG): (rate.get('Cur_OfficialRate') *
-                                                                                  scale / v.get('Cur_Scale'))
-                          for rate in response})
+                return 1.0, {}
+            responses[0] = response
+
+        parse_long = self._parse_long
+        for i, v in enumerate(vals):
+            mul = scale / v['Cur_Scale']
+            for rate in responses[i]:
+                date, value = parse_long(rate.get('Date')), rate.get('Cur_OfficialRate')
+                if date and value is not None:
+                    rates[date] = value * mul
 
         if len(rates) == 0:
-            self.last_error = f'The rates for currency "{val.upper()}" not found'
+            self.last_error = f'The rates for currency "{val_upper}" not found'
             return 1.0, {}
 
         return scale, rates
 
-    @clear_error
     def make_plot(self, val, start_date, end_date):
         """ This function makes a plot of the rate dynamics for the period.
             It receives:
@@ -177,21 +278,66 @@ class CurrencyConverter:
                start_date - the beginning of period in format 'YYYY-MM-DD'
                end_date - the end of period in format 'YYYY-MM-DD'
         """
+        self.last_error = None
         scale, rates = self.get_rate_dynamics(val, start_date, end_date)
         if len(rates) == 0:
             return
 
-        plt.style.use('seaborn')
+        import matplotlib.pyplot as plt
+        import numpy as np
+
+        if not CurrencyConverter._style_applied:
+            plt.style.use('seaborn')
+            CurrencyConverter._style_applied = True
+
+        val_upper = val.upper()
         fig, ax = plt.subplots()
         fig.canvas.manager.set_window_title('The rate dynamics')
-        ax.set_title(f'The rates of {scale:.0f} {val.upper()} in BYN')
-        ax.plot(rates.keys(), rates.values(), '-o', label=f'{scale:.0f} {val.upper()}')
+        ax.set_title(f'The rates of {scale:.0f} {val_upper} in BYN')
+        dates = np.array(list(rates.keys()), dtype='datetime64[s]')
+        values = np.fromiter(rates.values(), dtype=np.float64, count=len(rates))
+        ax.plot(dates, values, '-o', label=f'{scale:.0f} {val_upper}')
         fig.autofmt_xdate()
         ax.autoscale()
         ax.legend()
         plt.show()
 
-    @clear_error
+    def _cached_rate(self, val_upper, date):
+        """Return a cached tuple with currency scale and rate or None if it is missing or expired."""
+        cached = self._rate_cache.get((val_upper, date))
+        if cached and time.monotonic() - cached[0] < self.RATE_TTL:
+            self._rate_cache.move_to_end((val_upper, date))
+            return cached[1]
+        return None
+
+    def _fetch_rate(self, val_upper, date):
+        """Return a tuple with currency scale and rate, and an error message (None on success)."""
+        rate = self._cached_rate(val_upper, date)
+        if rate:
+            return rate, None
+
+        params = {'parammode': 2}
+        if date:
+            params['ondate'] = date
+
+        url = self._rate_urls.get(val_upper)
+        if url is None:
+            url = self._rate_urls[val_upper] = self._RATES_PREFIX + val_upper
+
+        response, error = self._make_request(url, params)
+        if error:
+            return (1.0, 0.0), str(error)
+
+        if len(response) == 0:
+            return (1.0, 0.0), f'The rate for currency "{val_upper}" not found'
+
+        rate = response.get('Cur_Scale', 1.0), response.get('Cur_OfficialRate', 0.0)
+        self._rate_cache[(val_upper, date)] = (time.monotonic(), rate)
+        self._rate_cache.move_to_end((val_upper, date))
+        if len(self._rate_cache) > self.RATE_CACHE_SIZE:
+            self._rate_cache.popitem(last=False)
+        return rate, None
+
     def get_rate(self, val, date=None):
         """ This function finds rate of currency in BYN.
             It receives:
@@ -199,32 +345,67 @@ class CurrencyConverter:
                date - the date in format 'YYYY-MM-DD'
             It returns a tuple with currency scale and rate.
         """
-        if not self._check_val_code(val):
+        self.last_error = None
+        val_upper = self._normalize(val)
+        if not val_upper:
             self.last_error = f'The currency code "{val}" is incorrect'
             return 1.0, 0.0
 
-        if val.upper() == 'BYN':
+        if val_upper == 'BYN':
             return 1.0, 1.0
 
-        params = {'parammode': 2}
-        if date:
-            if not self._date_from_str(date, self.DATE_SHORT):
-                self.last_error = f'The date "{date}" is incorrect'
-                return 1.0, 0.0
-            params['ondate'] = date
-
-        response, error = self._make_request(f'{self.REQUEST_RATES}/{val.upper()}', params)
-        if error:
-            self.last_error = str(error)
+        if date and not self._date_from_str(date, self.DATE_SHORT):
+            self.last_error = f'The date "{date}" is incorrect'
             return 1.0, 0.0
 
-        if len(response) == 0:
-            self.last_error = f'The rate for currency "{val.upper()}" not found'
-            return 1.0, 0.0
+        rate, self.last_error = self._fetch_rate(val_upper, date)
+        return rate
+
+    def _get_rates(self, from_val, to_val, date):
+        """Return a tuple with scales and rates of both currencies, an empty tuple if the currencies are the same
+        or None if an error occurred."""
+        from_upper = self._normalize(from_val)
+        if not from_upper:
+            self.last_error = f'The currency code "{from_val}" is incorrect'
+            return None
+
+        to_upper = self._normalize(to_val)
+        if not to_upper:
+            self.last_error = f'The currency code "{to_val}" is incorrect'
+            return None
+
+        if from_upper == to_upper:
+            return ()
+
+        if date and not self._date_from_str(date, self.DATE_SHORT):
+            self.last_error = f'The date "{date}" is incorrect'
+            return None
+
+        rates = {'BYN': (1.0, 1.0)}
+        vals = []
+        for v in (from_upper, to_upper):
+            if v in rates:
+                continue
+            rate = self._cached_rate(v, date)
+            if rate:
+                rates[v] = rate
+            else:
+                vals.append(v)
+
+        if len(vals) > 1:
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                results = list(executor.map(self._fetch_rate, vals, [date] * len(vals)))
+        else:
+            results = [self._fetch_rate(v, date) for v in vals]
 
-        return response.get('Cur_Scale', 1.0), response.get('Cur_OfficialRate', 0.0)
+        for v, (rate, error) in zip(vals, results):
+            if error is not None:
+                self.last_error = error
+                return None
+            rates[v] = rate
+
+        return rates[from_upper], rates[to_upper]
 
-    @clear_error
     def convert(self, summa, from_val, to_val="BYN", date=None):
         """ This function converts summa from one currency to other currency.
             It receives:
@@ -234,51 +415,97 @@ class CurrencyConverter:
                 date - the date in format 'YYYY-MM-DD'
             It returns a summa in the target currency.
         """
+        self.last_error = None
         if not isinstance(summa, (int, float)):
             self.last_error = f'The summa "{summa}" is incorrect'
             return 0.0
 
-        if not self._check_val_code(from_val):
-            self.last_error = f'The currency code "{from_val}" is incorrect'
-            return 0.0
-
-        if not self._check_val_code(to_val):
-            self.last_error = f'The currency code "{to_val}" is incorrect'
+        rates = self._get_rates(from_val, to_val, date)
+        if rates is None:
             return 0.0
 
-        if from_val.upper() == to_val.upper():
+        if not rates:
             return summa
 
-        summa_in_byn = summa
-        if from_val.upper() != 'BYN':
-            rate = self.get_rate(from_val, date)
-            if self.last_error:
-                return 0.0
-            summa_in_byn = summa / rate[0] * rate[1] if rate[0] != 0 else 0.0
+        (scale_from, rate_from), (scale_to, rate_to) = rates
+        summa_in_byn = summa / scale_from * rate_from if scale_from != 0 else 0.0
+        return summa_in_byn / rate_to * scale_to if rate_to != 0 else 0.0
 
-        rate = self.get_rate(to_val, date)
-        if self.last_error:
-            return 0.0
-        return summa_in_byn / rate[1] * rate[0] if rate[1] != 0 else 0.0
+    def convert_many(self, summas, from_val, to_val="BYN", date=None):
+        """ This function converts a sequence of summas from one currency to other currency.
+            It receives:
+                summas - the sequence (or NumPy array) of summas to convert
+                from_val - the source currency code
+                to_val - the target currency code
+                date - the date in format 'YYYY-MM-DD'
+            It returns a NumPy array of summas in the target currency.
+        """
+        import numpy as np
 
+        self.last_error = None
+        try:
+            values = np.asarray(summas)
+        except ValueError:
+            values = np.empty(len(summas), dtype=object)
+        if values.dtype.kind not in 'biuf':
+            self.last_error = f'The summas "{summas}" are incorrect'
+            return np.zeros(values.shape)
 
-def get_args(argv):
-    """Parsing command-line arguments."""
+        values = values.astype(np.float64)
+        rates = self._get_rates(from_val, to_val, date)
+        if rates is None:
+            return np.zeros_like(values)
+
+        if not rates:
+            return values
+
+        (scale_from, rate_from), (scale_to, rate_to) = rates
+        if scale_from == 0 or rate_to == 0:
+            return np.zeros_like(values)
+        return values / scale_from * rate_from / rate_to * scale_to
+
+
+_CUR_RE = re.compile(r'[A-Za-z]{3}(?:-[A-Za-z]{3})?')
+_DATE_RE = re.compile(r'\d{4}-\d{2}-\d{2}')
+
+
+def _currency(value):
+    """Check the currency argument format."""
+    if not _CUR_RE.fullmatch(value):
+        raise argparse.ArgumentTypeError(f'The currency code "{value}" is incorrect')
+    return value
+
+
+def _date(value):
+    """Check the date argument format."""
+    if not _DATE_RE.fullmatch(value):
+        raise argparse.ArgumentTypeError(f'The date "{value}" is incorrect')
+    return value
+
+
+@functools.lru_cache(maxsize=None)
+def _build_parser(plot):
+    """Build command-line arguments parser (the --date option takes two dates for plot)."""
     parser = argparse.ArgumentParser(prog='converter.py', description='Python command-line currency converter')
     parser.add_argument('--version', action='version', version='"Version {version}"'.format(version=__version__),
                         help='print version info')
     parser.add_argument('summa', type=float, nargs='?', default=1.0,
                         help='the summa to convert')
-    parser.add_argument('currency', type=str,
+    parser.add_argument('currency', type=_currency,
                         help=('the alphabetic currency code according to ISO 4217 '
                               '(use format "FROM-TO" to set target currency other than "BYN")'))
-    parser.add_argument('--date', nargs=2 if '--plot' in argv[1:] else None, required=('--plot' in argv[1:]),
+    parser.add_argument('--date', type=_date, nargs=2 if plot else None, required=plot,
                         help='the date for rate or the period for plot (in format "YYYY-MM-DD")')
     parser.add_argument('--rate', action='store_true', default=False,
                         help='print the rate on the date')
     parser.add_argument('--plot', action='store_true', default=False,
                         help='make a plot of the rate dynamics for the period')
-    return parser.parse_args(argv[1:])
+    return parser
+
+
+def get_args(argv):
+    """Parsing command-line arguments."""
+    return _build_parser('--plot' in argv[1:]).parse_args(argv[1:])
 
 
 def main():
@@ -15,7 +15,10 @@ setup(
     long_description_content_type="text/markdown",
     url='https://github.com/JuliaLos/CurrencyConverter',
     packages=find_packages(exclude=['tests']),
-    install_requires=['matplotlib>=3.5.1', 'requests>=2.27.1'],
+    install_requires=['matplotlib>=3.5.1', 'numpy>=1.22.2', 'requests>=2.27.1', 'urllib3>=1.26.8'],
+    extras_require={
+        'fast': ['orjson>=3.6.7'],
+    },
     python_requires='>=3.9',
     entry_points={
         'console_scripts': [
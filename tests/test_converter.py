@@ -1,13 +1,18 @@
-import argparse
+import matplotlib.pyplot as plt
+import numpy as np
 import pytest
 import requests
 import requests_mock
+import subprocess
+import sys
+import time
 
 from contextlib import nullcontext
-from converter.converter import CurrencyConverter, get_args
+from converter.converter import CurrencyConverter, JitterRetry, _build_parser, get_args
 from datetime import datetime
 from io import StringIO
 from unittest import mock
+from urllib3.response import HTTPResponse
 
 TEST_DATA_RATE_1 = {'Cur_Scale': 1.0,
                     'Cur_OfficialRate': 2.0,
@@ -27,6 +32,30 @@ TEST_DATA_VAL_2 = [{'Cur_ID': 159,
                     'Cur_DateStart': '2020-01-01T00:00:00',
                     'Cur_DateEnd': '2050-01-01T00:00:00',
                     }]
+TEST_DATA_VAL_3 = [{'Cur_ID': 145,
+                    'Cur_Scale': 1.0,
+                    'Cur_Abbreviation': 'USD',
+                    'Cur_DateStart': '2020-01-01T00:00:00',
+                    'Cur_DateEnd': '2022-02-07T00:00:00',
+                    },
+                   {'Cur_ID': 159,
+                    'Cur_Scale': 10.0,
+                    'Cur_Abbreviation': 'USD',
+                    'Cur_DateStart': '2022-02-08T00:00:00',
+                    'Cur_DateEnd': '2050-01-01T00:00:00',
+                    }]
+TEST_DATA_VAL_4 = [{'Cur_ID': 159,
+                    'Cur_Scale': 1.0,
+                    'Cur_Abbreviation': 'USD',
+                    'Cur_DateStart': '2022-02-10T00:00:00',
+                    'Cur_DateEnd': '2022-02-20T00:00:00',
+                    },
+                   {'Cur_ID': 145,
+                    'Cur_Scale': 1.0,
+                    'Cur_Abbreviation': 'EUR',
+                    'Cur_DateStart': '2020-01-01T00:00:00',
+                    'Cur_DateEnd': '2050-01-01T00:00:00',
+                    }]
 TEST_DATA_DYN_1 = [{'Date': '2022-02-14T00:00:00',
                     'Cur_OfficialRate': 2.0,
                     }]
@@ -36,6 +65,42 @@ TEST_DATA_DYN_2 = [{'Date': '2022-02-01T00:00:00',
                    {'Date': '2022-02-14T00:00:00',
                     'Cur_OfficialRate': 2.5,
                     }]
+TEST_DATA_DYN_3 = [{'Date': '2022-02-01T00:00:00',
+                    'Cur_OfficialRate': 0.2,
+                    }]
+TEST_DATA_DYN_4 = [{'Date': '2022-02-01T00:00:00',
+                    'Cur_OfficialRate': None,
+                    },
+                   {'Cur_OfficialRate': 2.0,
+                    },
+                   {'Date': '2022-02-14T00:00:00',
+                    'Cur_OfficialRate': 2.5,
+                    }]
+
+
+@pytest.fixture(scope="module")
+def module_http_mock():
+    with requests_mock.Mocker() as m:
+        yield m
+
+
+@pytest.fixture
+def http_mock(module_http_mock):
+    # every test registers its own routes, and the latest registered matcher takes precedence
+    yield module_http_mock
+    module_http_mock.reset_mock()
+
+
+@pytest.fixture(scope="module")
+def module_currency_converter():
+    with CurrencyConverter() as c:
+        yield c
+
+
+@pytest.fixture
+def currency_converter(module_currency_converter):
+    yield module_currency_converter
+    module_currency_converter.clear_cache()
 
 
 @pytest.mark.parametrize(
@@ -54,7 +119,14 @@ TEST_DATA_DYN_2 = [{'Date': '2022-02-01T00:00:00',
     ],
 )
 def test_get_args_correct(command, expected):
-    assert get_args(command) == argparse.Namespace(**expected)
+    assert vars(get_args(command)) == expected
+
+
+def test_build_parser_cached():
+    get_args(['converter.py', 'usd'])
+    get_args(['converter.py', 'usd', '--plot', '--date', '2022-02-01', '2022-02-14'])
+    assert _build_parser(False) is _build_parser(False)
+    assert _build_parser(True) is not _build_parser(False)
 
 
 @pytest.mark.parametrize(
@@ -69,32 +141,72 @@ def test_get_args_correct(command, expected):
          ["error: the following arguments are required: currency"]),
         (['converter.py', 'usd', '--plot', '--date', '2022-02-01'], pytest.raises(SystemExit),
          ["error: argument --date: expected 2 arguments"]),
+        (['converter.py', '100', 'usdx'], pytest.raises(SystemExit),
+         ['error: argument currency: The currency code "usdx" is incorrect']),
+        (['converter.py', '100', 'usd-eu'], pytest.raises(SystemExit),
+         ['error: argument currency: The currency code "usd-eu" is incorrect']),
+        (['converter.py', '100', 'usd\n'], pytest.raises(SystemExit),
+         ['error: argument currency: The currency code "usd\n" is incorrect']),
+        (['converter.py', 'usd', '--rate', '--date', '2022-02-14\n'], pytest.raises(SystemExit),
+         ['error: argument --date: The date "2022-02-14\n" is incorrect']),
+        (['converter.py', 'usd', '--rate', '--date', '14.02.2022'], pytest.raises(SystemExit),
+         ['error: argument --date: The date "14.02.2022" is incorrect']),
+        (['converter.py', 'usd', '--plot', '--date', '2022-02-01', '2022-2-14'], pytest.raises(SystemExit),
+         ['error: argument --date: The date "2022-2-14" is incorrect']),
     ],
 )
 def test_get_args_incorrect(command, exception, expected):
     with mock.patch('sys.stderr', new_callable=StringIO) as mock_stderr:
         with exception:
             get_args(command)
-            assert expected[0] in mock_stderr.getvalue()
+        assert expected[0] in mock_stderr.getvalue()
 
 
 @pytest.mark.parametrize(
-    "params,exception",
+    "val,expected",
     [
-        ({'exc': requests.exceptions.ConnectionError}, [requests.exceptions.ConnectionError]),
-        ({'exc': requests.exceptions.URLRequired}, [requests.exceptions.URLRequired]),
-        ({'exc': requests.exceptions.Timeout}, [requests.exceptions.Timeout]),
-        ({'status_code': 404}, [requests.exceptions.HTTPError]),
-        ({'text': 'json'}, [requests.exceptions.JSONDecodeError]),
+        ('usd', 'USD'),
+        ('Eur', 'EUR'),
+        ('us', None),
+        ('usd1', None),
+        ('u$d', None),
+        ('дол', None),
+        (100, None),
+        (None, None),
     ],
 )
-def test_make_request(params, exception):
-    with requests_mock.Mocker() as m:
-        m.get(f'{CurrencyConverter.REQUEST_RATES}/USD?parammode=2', **params)
-        try:
-            assert CurrencyConverter().convert(100, 'usd') == 0.0
-        except exception[0]:
-            assert False, f'function _make_request() raised an exception: {exception[0]}'
+def test_normalize(val, expected):
+    assert CurrencyConverter._normalize(val) == expected
+
+
+@pytest.mark.parametrize(
+    "date_string,expected",
+    [
+        ('2022-02-14T00:00:00', datetime(2022, 2, 14, 0, 0)),
+        ('2022-02-14T12:30:15.000', datetime(2022, 2, 14, 12, 30, 15)),
+        ('2022-02-30T00:00:00', None),
+        ('2022-02-14', None),
+        ('date-time-string', None),
+        (None, None),
+    ],
+)
+def test_parse_long(date_string, expected):
+    assert CurrencyConverter._parse_long(date_string) == expected
+
+
+@pytest.mark.parametrize(
+    "params",
+    [
+        {'exc': requests.exceptions.ConnectionError},
+        {'exc': requests.exceptions.URLRequired},
+        {'exc': requests.exceptions.Timeout},
+        {'status_code': 404},
+        {'text': 'json'},
+    ],
+)
+def test_make_request(http_mock, currency_converter, params):
+    http_mock.get(f'{CurrencyConverter.REQUEST_RATES}/USD?parammode=2', **params)
+    assert currency_converter.convert(100, 'usd') == 0.0
 
 
 @pytest.mark.parametrize(
@@ -108,13 +220,53 @@ def test_make_request(params, exception):
         ([100, 'usd'], {}, (1.0, 0.0)),
     ],
 )
-def test_get_rate(args, params, expected):
-    with requests_mock.Mocker() as m:
-        m.get(f'{CurrencyConverter.REQUEST_RATES}/USD?parammode=2', json=params)
-        try:
-            assert CurrencyConverter().get_rate(*args) == expected
-        except Exception as e:
-            assert False, f'function get_rate() raised an exception: {e}'
+def test_get_rate(http_mock, currency_converter, args, params, expected):
+    http_mock.get(f'{CurrencyConverter.REQUEST_RATES}/USD?parammode=2', json=params)
+    assert currency_converter.get_rate(*args) == expected
+
+
+def test_get_rate_cache(http_mock):
+    http_mock.get(f'{CurrencyConverter.REQUEST_RATES}/USD?parammode=2', json=TEST_DATA_RATE_1)
+    c = CurrencyConverter()
+    assert c.get_rate('usd') == c.get_rate('USD') == (1.0, 2.0)
+    assert http_mock.call_count == 1
+    with mock.patch('time.monotonic', return_value=time.monotonic() + CurrencyConverter.RATE_TTL):
+        assert c.get_rate('usd') == (1.0, 2.0)
+    assert http_mock.call_count == 2
+    c.clear_cache()
+    assert c.get_rate('usd') == (1.0, 2.0)
+    assert http_mock.call_count == 3
+
+
+def test_get_rate_cache_size(http_mock):
+    http_mock.get(f'{CurrencyConverter.REQUEST_RATES}/USD', json=TEST_DATA_RATE_1)
+    c = CurrencyConverter()
+    with mock.patch.object(CurrencyConverter, 'RATE_CACHE_SIZE', 2):
+        for date in ['2022-02-01', '2022-02-02', '2022-02-01', '2022-02-03']:
+            c.get_rate('usd', date)
+    assert list(c._rate_cache) == [('USD', '2022-02-01'), ('USD', '2022-02-03')]
+    assert http_mock.call_count == 3
+
+
+@pytest.mark.parametrize(
+    "method,args",
+    [
+        ('get_rate', [100.0, 200.0]),
+        ('get_rate', ['usd', 'date']),
+        ('get_rate', ['usd', '2022-02-30']),
+        ('convert', ['100', 'usd']),
+        ('convert', [100, 'usd', 'eur', '2022-14-02']),
+        ('convert', [100, 'usd', 'euro']),
+        ('convert_many', [['100'], 'usd']),
+        ('get_rate_dynamics', ['usd', '2022-02-01', 'date']),
+        ('get_rate_dynamics', ['usd', '2020-02-01', '2022-02-01']),
+    ],
+)
+def test_incorrect_args_no_request(http_mock, method, args):
+    c = CurrencyConverter()
+    getattr(c, method)(*args)
+    assert c.last_error
+    assert http_mock.call_count == 0
 
 
 @pytest.mark.parametrize(
@@ -128,16 +280,52 @@ def test_get_rate(args, params, expected):
         ([100, '200', 'date'], TEST_DATA_RATE_2, [0.0]),
         ([None, None, None], TEST_DATA_RATE_1, [0.0]),
         ([100, 'byn', 'usd'], {}, [0.0]),
+        ([10 ** 17 + 1, 'usd', 'USD'], {}, [10 ** 17 + 1]),
         ([100, 'usd'], {}, [0.0]),
     ],
 )
-def test_convert(args, params, expected):
-    with requests_mock.Mocker() as m:
-        m.get(f'{CurrencyConverter.REQUEST_RATES}/USD?parammode=2', json=params)
-        try:
-            assert CurrencyConverter().convert(*args) == expected[0]
-        except Exception as e:
-            assert False, f'function convert() raised an exception: {e}'
+def test_convert(http_mock, currency_converter, args, params, expected):
+    http_mock.get(f'{CurrencyConverter.REQUEST_RATES}/USD?parammode=2', json=params)
+    assert currency_converter.convert(*args) == expected[0]
+
+
+@pytest.mark.parametrize(
+    "args,params,expected",
+    [
+        ([[100, 200], 'usd'], TEST_DATA_RATE_1, [200.0, 400.0]),
+        ([np.array([100.0, 200.0]), 'usd', 'byn', '2022-02-14'], TEST_DATA_RATE_2, [20.0, 40.0]),
+        ([(100.0, 50.0), 'byn', 'usd'], TEST_DATA_RATE_1, [50.0, 25.0]),
+        ([[100.0, 50.0], 'usd', 'usd'], TEST_DATA_RATE_1, [100.0, 50.0]),
+        ([[True, False], 'usd'], TEST_DATA_RATE_1, [2.0, 0.0]),
+        ([['100', '200'], 'usd'], TEST_DATA_RATE_1, [0.0, 0.0]),
+        ([[[100], [200, 300]], 'usd'], TEST_DATA_RATE_1, [0.0, 0.0]),
+        ([[100, 200], 'usd', 'date'], TEST_DATA_RATE_1, [0.0, 0.0]),
+        ([[100, 200], 'usd'], {}, [0.0, 0.0]),
+    ],
+)
+def test_convert_many(http_mock, args, params, expected):
+    http_mock.get(f'{CurrencyConverter.REQUEST_RATES}/USD?parammode=2', json=params)
+    assert list(CurrencyConverter().convert_many(*args)) == expected
+
+
+@pytest.mark.parametrize(
+    "params1,params2,expected",
+    [
+        ({'json': TEST_DATA_RATE_1}, {'json': TEST_DATA_RATE_2}, [1000.0]),
+        ({'json': TEST_DATA_RATE_1}, {'json': {}}, [0.0]),
+        ({'status_code': 500}, {'json': TEST_DATA_RATE_2}, [0.0]),
+    ],
+)
+def test_convert_pair(http_mock, params1, params2, expected):
+    http_mock.get(f'{CurrencyConverter.REQUEST_RATES}/USD?parammode=2', **params1)
+    http_mock.get(f'{CurrencyConverter.REQUEST_RATES}/EUR?parammode=2', **params2)
+    c = CurrencyConverter()
+    assert c.convert(100, 'usd', 'eur') == expected[0]
+    assert (c.last_error is None) == (expected[0] != 0.0)
+    if expected[0]:
+        with mock.patch('converter.converter.ThreadPoolExecutor') as mock_executor:
+            assert c.convert(100, 'usd', 'eur') == expected[0]
+        mock_executor.assert_not_called()
 
 
 @pytest.mark.parametrize(
@@ -152,6 +340,11 @@ def test_convert(args, params, expected):
           {datetime(2022, 2, 1, 0, 0): 2.0,
            datetime(2022, 2, 14, 0, 0): 2.5})
          ),
+        (['usd', '2022-02-01', '2022-03-01'], TEST_DATA_VAL_4, TEST_DATA_DYN_1,
+         (1.0,
+          {datetime(2022, 2, 14, 0, 0): 2.0})
+         ),
+        (['usd', '2022-01-01', '2022-02-01'], TEST_DATA_VAL_4, TEST_DATA_DYN_1, (1.0, {})),
         (['usd', '2020-02-01', '2022-02-01'], TEST_DATA_VAL_1, TEST_DATA_DYN_1, (1.0, {})),
         (['100', '2022-02-01', '2022-02-14'], TEST_DATA_VAL_2, TEST_DATA_DYN_2, (1.0, {})),
         ([100, 200, 300], TEST_DATA_VAL_1, TEST_DATA_DYN_1, (1.0, {})),
@@ -159,13 +352,134 @@ def test_convert(args, params, expected):
         ([None, None, None], TEST_DATA_VAL_1, TEST_DATA_DYN_1, (1.0, {})),
         (['usd', '2022-02-01', '2022-02-14'], [], TEST_DATA_DYN_2, (1.0, {})),
         (['usd', '2022-02-01', '2022-02-14'], TEST_DATA_VAL_1, [], (1.0, {})),
+        (['usd', '2022-02-01', '2022-02-14'], TEST_DATA_VAL_1, TEST_DATA_DYN_4,
+         (1.0,
+          {datetime(2022, 2, 14, 0, 0): 2.5})
+         ),
     ],
 )
-def test_get_rate_dynamics(args, params1, params2, expected):
-    with requests_mock.Mocker() as m:
-        m.get(CurrencyConverter.REQUEST_CURRENCIES, json=params1)
-        m.get(f'{CurrencyConverter.REQUEST_DYNAMICS}/159', json=params2)
-        try:
-            assert CurrencyConverter().get_rate_dynamics(*args) == expected
-        except Exception as e:
-            assert False, f'function get_rate_dynamics() raised an exception: {e}'
+def test_get_rate_dynamics(http_mock, args, params1, params2, expected):
+    http_mock.get(CurrencyConverter.REQUEST_CURRENCIES, json=params1)
+    http_mock.get(f'{CurrencyConverter.REQUEST_DYNAMICS}/159', json=params2)
+    assert CurrencyConverter().get_rate_dynamics(*args) == expected
+
+
+@pytest.mark.parametrize(
+    "params1,params2,expected",
+    [
+        ({'json': TEST_DATA_DYN_3}, {'json': TEST_DATA_DYN_1},
+         (10.0,
+          {datetime(2022, 2, 1, 0, 0): 2.0,
+           datetime(2022, 2, 14, 0, 0): 2.0})
+         ),
+        ({'json': TEST_DATA_DYN_3}, {'status_code': 500}, (1.0, {})),
+        ({'exc': requests.exceptions.Timeout}, {'json': TEST_DATA_DYN_1}, (1.0, {})),
+    ],
+)
+def test_get_rate_dynamics_periods(http_mock, params1, params2, expected):
+    http_mock.get(CurrencyConverter.REQUEST_CURRENCIES, json=TEST_DATA_VAL_3)
+    http_mock.get(f'{CurrencyConverter.REQUEST_DYNAMICS}/145', **params1)
+    http_mock.get(f'{CurrencyConverter.REQUEST_DYNAMICS}/159', **params2)
+    assert CurrencyConverter().get_rate_dynamics('usd', '2022-02-01', '2022-02-14') == expected
+
+
+def test_get_rate_dynamics_params(http_mock):
+    http_mock.get(CurrencyConverter.REQUEST_CURRENCIES, json=TEST_DATA_VAL_3)
+    http_mock.get(f'{CurrencyConverter.REQUEST_DYNAMICS}/145', json=TEST_DATA_DYN_3)
+    http_mock.get(f'{CurrencyConverter.REQUEST_DYNAMICS}/159', json=TEST_DATA_DYN_1)
+    CurrencyConverter().get_rate_dynamics('usd', '2022-02-14', '2022-02-01')
+    assert sorted((r.qs for r in http_mock.request_history if r.qs), key=lambda x: x['startdate']) == [
+        {'startdate': ['2022-02-01'], 'enddate': ['2022-02-07']},
+        {'startdate': ['2022-02-08'], 'enddate': ['2022-02-14']},
+    ]
+
+
+def test_get_rate_dynamics_cache(http_mock):
+    http_mock.get(CurrencyConverter.REQUEST_CURRENCIES, json=TEST_DATA_VAL_1)
+    http_mock.get(f'{CurrencyConverter.REQUEST_DYNAMICS}/159', json=TEST_DATA_DYN_1)
+    c = CurrencyConverter()
+    assert c.get_rate_dynamics('usd', '2022-02-01', '2022-02-14') == (1.0, {datetime(2022, 2, 14, 0, 0): 2.0})
+    assert c.get_rate_dynamics('usd', '2022-02-01', '2022-02-14') == (1.0, {datetime(2022, 2, 14, 0, 0): 2.0})
+    with mock.patch('converter.converter.ThreadPoolExecutor') as mock_executor:
+        assert c.get_rate_dynamics('usd', '2022-02-01', '2022-02-14') == (1.0, {datetime(2022, 2, 14, 0, 0): 2.0})
+    mock_executor.assert_not_called()
+    assert [r.url for r in http_mock.request_history].count(CurrencyConverter.REQUEST_CURRENCIES) == 1
+
+
+def test_index_currencies():
+    index = CurrencyConverter()._index_currencies(TEST_DATA_VAL_4 + [{'Cur_ID': 1, 'Cur_Abbreviation': 'RUB'},
+                                                                     {'Cur_ID': 2, 'Cur_Abbreviation': 'GBP',
+                                                                      'Cur_DateStart': '2022-02-30T00:00:00',
+                                                                      'Cur_DateEnd': '2050-01-01T00:00:00'}])
+    assert sorted(index) == ['EUR', 'USD']
+    assert index['USD'] == [{'Cur_ID': 159,
+                             'Cur_Scale': 1.0,
+                             'Cur_DateStart': datetime(2022, 2, 10, 0, 0),
+                             'Cur_DateEnd': datetime(2022, 2, 20, 0, 0)}]
+
+
+def test_session_retries():
+    with CurrencyConverter() as c:
+        retries = c._session.adapters['https://'].max_retries
+        assert (retries.total, retries.connect, retries.read) == (3, 2, 2)
+        assert tuple(retries.status_forcelist) == (502, 503, 504)
+        assert retries.respect_retry_after_header
+        response = HTTPResponse(status=503, headers={'Retry-After': '600'})
+        with mock.patch('time.sleep') as mock_sleep:
+            retries.increment(method='GET', url='/', response=response).sleep(response)
+        mock_sleep.assert_called_once_with(JitterRetry.RETRY_AFTER_MAX)
+
+
+def test_request_timeout(http_mock):
+    http_mock.get(f'{CurrencyConverter.REQUEST_RATES}/USD', json=TEST_DATA_RATE_1)
+    CurrencyConverter().get_rate('usd')
+    assert http_mock.last_request.timeout == CurrencyConverter.TIMEOUT
+
+
+def test_lazy_imports():
+    code = "import converter, sys; print('numpy' in sys.modules, 'matplotlib' in sys.modules)"
+    assert subprocess.check_output([sys.executable, '-c', code], text=True).split() == ['False', 'False']
+
+
+def test_slots():
+    c = CurrencyConverter()
+    assert not hasattr(c, '__dict__')
+    with pytest.raises(AttributeError):
+        c.unknown = None
+
+
+def test_context_manager():
+    with mock.patch.object(requests.Session, 'close') as mock_close:
+        with CurrencyConverter():
+            mock_close.assert_not_called()
+    mock_close.assert_called_once()
+
+
+def test_make_plot(http_mock):
+    http_mock.get(CurrencyConverter.REQUEST_CURRENCIES, json=TEST_DATA_VAL_2)
+    http_mock.get(f'{CurrencyConverter.REQUEST_DYNAMICS}/159', json=TEST_DATA_DYN_2)
+    with mock.patch('matplotlib.pyplot.style.use') as mock_style, \
+            mock.patch('matplotlib.pyplot.show') as mock_show, \
+            mock.patch.object(CurrencyConverter, '_style_applied', False):
+        CurrencyConverter().make_plot('usd', '2022-02-01', '2022-02-14')
+        mock_show.assert_called_once()
+        line = plt.gca().get_lines()[0]
+        assert list(line.get_ydata()) == [2.0, 2.5]
+        CurrencyConverter().make_plot('usd', '2022-02-01', '2022-02-14')
+        mock_style.assert_called_once_with('seaborn')
+        plt.close('all')
+
+
+@pytest.mark.parametrize(
+    "history_len,expected",
+    [
+        (0, (0.0, 0.0)),
+        (2, (1.0, 1.0 + JitterRetry.BACKOFF_JITTER)),
+        (3, (2.0, 2.0 + JitterRetry.BACKOFF_JITTER)),
+    ],
+)
+def test_jitter_retry(history_len, expected):
+    retry = JitterRetry(total=3, backoff_factor=0.5)
+    for _ in range(history_len):
+        retry = retry.increment(method='GET', url='/', error=requests.exceptions.ConnectionError())
+    assert expected[0] <= retry.get_backoff_time() <= expected[1]